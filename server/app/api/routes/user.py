@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 import logging
@@ -12,19 +13,17 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
+def _save_user(db: Session, user: User) -> None:
+    db.commit()
+    db.refresh(user)
+
+
 @router.get("/me", response_model=UserSchema)
 async def read_users_me(current_user: User = Depends(get_current_user)):
     """
     Get current authenticated user
     """
-    # Log the current user data
-    logger.info("Fetched profile for user_id=%s", current_user.id)
-
-    # Ensure email is valid before returning
-    if not current_user.email or "@" not in current_user.email:
-        logger.warning(f"Invalid email found in user record: '{current_user.email}'")
-        # This is just for logging - the schema validator will handle this
-
+    logger.debug("Fetched profile for user_id=%s", current_user.id)
     return current_user
 
 
@@ -37,14 +36,13 @@ async def update_user(
     """
     Update current user
     """
-    for field, value in user_data.model_dump(exclude_unset=True).items():
-        setattr(current_user, field, value)
+    for field in user_data.model_fields_set:
+        setattr(current_user, field, getattr(user_data, field))
 
     try:
-        db.commit()
-        db.refresh(current_user)
+        await run_in_threadpool(_save_user, db, current_user)
     except IntegrityError:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Update conflicts with an existing user record",
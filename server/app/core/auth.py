@@ -1,12 +1,20 @@
+from collections import OrderedDict
 from functools import lru_cache
 from typing import Any, Dict, Optional
+import asyncio
+import hashlib
 import logging
+import threading
+import time
 
 import httpx
 import jwt
 from fastapi import Depends, Header, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from jwt import PyJWKClient
+from jwt import PyJWK, PyJWKClient, PyJWKSet
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
@@ -17,46 +25,220 @@ from app.models.models import User
 logger = logging.getLogger(__name__)
 security = HTTPBearer()
 
-
-@lru_cache(maxsize=8)
-def _build_jwks_client(jwks_url: str) -> PyJWKClient:
-    return PyJWKClient(jwks_url)
+CLERK_API_URL = "https://api.clerk.dev"
+
+_clerk_client: Optional[httpx.AsyncClient] = None
+
+# The JWKS is refreshed in the background and kept across failed refreshes.
+# Tokens are rejected with 503 only once the last good set is far past its TTL.
+JWKS_CACHE_LIFESPAN_SECONDS = 3600
+JWKS_REFRESH_INTERVAL_SECONDS = 600
+JWKS_MAX_STALENESS_SECONDS = 10 * JWKS_CACHE_LIFESPAN_SECONDS
+JWKS_MIN_FETCH_INTERVAL_SECONDS = 60
+JWKS_FETCH_TIMEOUT_SECONDS = 5
+
+_jwks: Optional[PyJWKSet] = None
+_jwks_fetched_at = float("-inf")
+_jwks_failed_at = float("-inf")
+_jwks_lock = threading.Lock()
+
+# Settings do not change at runtime, so the issuer (which also locates the
+# JWKS) and the decode arguments are fixed up front.
+_JWT_ALGORITHMS = ("RS256",)
+_JWT_ISSUER = settings.CLERK_JWT_ISSUER
+_JWT_AUDIENCE = settings.CLERK_AUDIENCE
+_JWT_DECODE_OPTIONS = {"verify_aud": bool(settings.CLERK_AUDIENCE)}
+
+# Decoded payloads of already-verified tokens, keyed by a digest of the raw token
+# and evicted least recently used first.
+TOKEN_CACHE_MAX_SIZE = 10_000
+TOKEN_CACHE_EXPIRY_SKEW_SECONDS = 30
+_token_cache: "OrderedDict[bytes, tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+# Clerk fetches started before the database says whether a user is new. They are
+# skipped for Clerk user IDs this process has already found in the database, and
+# the budget caps the rest, e.g. the first request of each user after a deploy.
+SEEN_USER_IDS_MAX_SIZE = 50_000
+_seen_user_ids: "OrderedDict[str, None]" = OrderedDict()
+SPECULATIVE_CLERK_FETCHES_PER_MINUTE = 10
+_speculative_window_start = float("-inf")
+_speculative_fetches_in_window = 0
+
+# Built once so SQLAlchemy's compiled-statement cache is hit on every lookup.
+# Served by the unique index on clerk_user_id. Every column is loaded on
+# purpose: the user response schema and the payments routes read them all.
+_USER_BY_CLERK_ID = select(User).where(
+    User.clerk_user_id == bindparam("clerk_user_id")
+)
+
+# Dialect-specific INSERT constructs that support ON CONFLICT ... RETURNING.
+_UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+@lru_cache(maxsize=1)
+def _build_jwks_client() -> PyJWKClient:
+    # Only used as a fetcher: PyJWKClient clears its own cache when a fetch fails,
+    # so the last good set is held in _jwks instead.
+    return PyJWKClient(
+        f"{_JWT_ISSUER}/.well-known/jwks.json",
+        cache_jwk_set=False,
+        timeout=JWKS_FETCH_TIMEOUT_SECONDS,
+    )
 
 
 def _get_jwks_client() -> PyJWKClient:
-    if not settings.CLERK_JWT_ISSUER:
+    if not _JWT_ISSUER:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Authentication is not configured",
         )
 
-    return _build_jwks_client(f"{settings.CLERK_JWT_ISSUER}/.well-known/jwks.json")
+    return _build_jwks_client()
 
 
-def validate_jwt(token: str) -> Dict[str, Any]:
-    jwks_client = _get_jwks_client()
+async def refresh_jwks() -> None:
+    """Fetch the JWKS in the threadpool, keeping the current set on failure."""
+    if not _JWT_ISSUER:
+        return
 
     try:
-        signing_key = jwks_client.get_signing_key_from_jwt(token).key
+        await run_in_threadpool(_fetch_jwks)
     except Exception:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token key ID",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        logger.warning("Failed to refresh Clerk JWKS", exc_info=True)
+
 
-    decode_kwargs: Dict[str, Any] = {
-        "key": signing_key,
-        "algorithms": ["RS256"],
-        "issuer": settings.CLERK_JWT_ISSUER,
-    }
-    if settings.CLERK_AUDIENCE:
-        decode_kwargs["audience"] = settings.CLERK_AUDIENCE
-    else:
-        decode_kwargs["options"] = {"verify_aud": False}
+async def refresh_jwks_periodically() -> None:
+    """Keep the JWKS warm so token validation does not fetch it inline."""
+    while True:
+        await asyncio.sleep(JWKS_REFRESH_INTERVAL_SECONDS)
+        await refresh_jwks()
 
+
+def _fetch_jwks() -> PyJWKSet:
+    """Fetch the JWKS and swap it in; the current set is kept if the fetch fails."""
+    global _jwks, _jwks_fetched_at, _jwks_failed_at
     try:
-        return jwt.decode(token, **decode_kwargs)
+        jwks = _get_jwks_client().get_jwk_set()
+    except Exception:
+        _jwks_failed_at = time.monotonic()
+        raise
+    _jwks, _jwks_fetched_at = jwks, time.monotonic()
+    return jwks
+
+
+def _refetch_jwks(seen: Optional[PyJWKSet]) -> Optional[PyJWKSet]:
+    """
+    Refetch the JWKS for a request that ``seen`` could not serve. Called from the
+    threadpool; returns None when the fetch is skipped or fails.
+    """
+    with _jwks_lock:
+        if _jwks is not seen:
+            # Another request refreshed the set while this one waited.
+            return _jwks
+
+        # A set fetched under a minute ago is current, so an unknown kid is not a
+        # rotation; a recent failure means the provider is still unreachable.
+        now = time.monotonic()
+        if (
+            now - _jwks_fetched_at < JWKS_MIN_FETCH_INTERVAL_SECONDS
+            or now - _jwks_failed_at < JWKS_MIN_FETCH_INTERVAL_SECONDS
+        ):
+            return None
+
+        try:
+            return _fetch_jwks()
+        except HTTPException:
+            raise
+        except Exception:
+            logger.warning("Failed to fetch Clerk JWKS", exc_info=True)
+            return None
+
+
+def _find_signing_key(jwks: PyJWKSet, kid: Optional[str]) -> Optional[PyJWK]:
+    for key in jwks.keys:
+        if key.key_id == kid and key.public_key_use in ("sig", None):
+            return key
+    return None
+
+
+def _get_signing_key(token: str) -> Any:
+    invalid_key_error = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid token key ID",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    unavailable_error = HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Unable to reach authentication provider",
+    )
+
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except jwt.InvalidTokenError:
+        raise invalid_key_error
+
+    jwks = _jwks
+    if jwks is None:
+        # Nothing fetched yet, e.g. the startup fetch failed.
+        jwks = _refetch_jwks(None)
+        if jwks is None:
+            raise unavailable_error
+    elif time.monotonic() - _jwks_fetched_at > JWKS_MAX_STALENESS_SECONDS:
+        raise unavailable_error
+
+    signing_key = _find_signing_key(jwks, kid)
+    if signing_key is None:
+        # Clerk may have rotated keys since the last refresh.
+        jwks = _refetch_jwks(jwks)
+        signing_key = _find_signing_key(jwks, kid) if jwks else None
+    if signing_key is None:
+        raise invalid_key_error
+
+    return signing_key.key
+
+
+def _cache_token_payload(cache_key: bytes, payload: Dict[str, Any]) -> None:
+    exp = payload.get("exp")
+    if not isinstance(exp, (int, float)):
+        return
+
+    _token_cache[cache_key] = (float(exp), payload)
+    if len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+        _token_cache.popitem(last=False)
+
+
+async def validate_jwt(token: str) -> Dict[str, Any]:
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    cached = _token_cache.get(cache_key)
+    if cached is not None:
+        exp, payload = cached
+        if exp > time.time() + TOKEN_CACHE_EXPIRY_SKEW_SECONDS:
+            _token_cache.move_to_end(cache_key)
+            return payload
+        _token_cache.pop(cache_key, None)
+
+    # A miss may refetch the JWKS and always runs an RS256 verify, so it is kept
+    # off the event loop.
+    payload = await run_in_threadpool(_decode_jwt, token)
+    _cache_token_payload(cache_key, payload)
+    return payload
+
+
+def _decode_jwt(token: str) -> Dict[str, Any]:
+    signing_key = _get_signing_key(token)
+
+    try:
+        return jwt.decode(
+            token,
+            signing_key,
+            algorithms=_JWT_ALGORITHMS,
+            issuer=_JWT_ISSUER,
+            audience=_JWT_AUDIENCE,
+            options=_JWT_DECODE_OPTIONS,
+        )
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -83,12 +265,39 @@ def validate_jwt(token: str) -> Dict[str, Any]:
         )
 
 
-async def _fetch_clerk_user(user_id: str, clerk_api_key: str) -> Dict[str, Any]:
-    headers = {"Authorization": f"Bearer {clerk_api_key}"}
-    url = f"https://api.clerk.dev/v1/users/{user_id}"
+def get_clerk_client() -> httpx.AsyncClient:
+    """Return the shared Clerk API client so connections are pooled across calls."""
+    global _clerk_client
+    if _clerk_client is None or _clerk_client.is_closed:
+        headers = (
+            {"Authorization": f"Bearer {settings.CLERK_SECRET_KEY}"}
+            if settings.CLERK_SECRET_KEY
+            else None
+        )
+        _clerk_client = httpx.AsyncClient(
+            base_url=CLERK_API_URL,
+            headers=headers,
+            timeout=httpx.Timeout(10.0, connect=2.0),
+            limits=httpx.Limits(
+                max_connections=50,
+                max_keepalive_connections=20,
+                keepalive_expiry=300,
+            ),
+            http2=True,
+        )
+    return _clerk_client
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.get(url, headers=headers)
+
+async def close_clerk_client() -> None:
+    """Close the shared Clerk API client, if one was created."""
+    global _clerk_client
+    if _clerk_client is not None:
+        await _clerk_client.aclose()
+        _clerk_client = None
+
+
+async def _fetch_clerk_user(user_id: str) -> Dict[str, Any]:
+    response = await get_clerk_client().get(f"/v1/users/{user_id}")
 
     if response.status_code != status.HTTP_200_OK:
         raise HTTPException(
@@ -106,12 +315,9 @@ def _extract_name(data: Dict[str, Any]) -> Optional[str]:
 
     first_name = data.get("first_name") or data.get("given_name")
     last_name = data.get("last_name") or data.get("family_name")
-    if first_name and last_name:
-        return f"{first_name} {last_name}"
-    if first_name:
-        return str(first_name)
-    if last_name:
-        return str(last_name)
+    full_name = " ".join(str(part) for part in (first_name, last_name) if part)
+    if full_name:
+        return full_name
 
     username = data.get("username")
     return str(username) if username else None
@@ -127,17 +333,12 @@ def _extract_claim_identity(payload: Dict[str, Any]) -> tuple[Optional[str], Opt
 
 
 def _extract_user_identity(clerk_user_data: Dict[str, Any]) -> tuple[str, Optional[str]]:
-    primary_email_obj = next(
-        (
-            email
-            for email in clerk_user_data.get("email_addresses", [])
-            if email.get("id") == clerk_user_data.get("primary_email_address_id")
-        ),
-        None,
-    )
+    email_addresses = clerk_user_data.get("email_addresses") or []
+    emails_by_id = {email["id"]: email for email in email_addresses if "id" in email}
+    primary_email_obj = emails_by_id.get(clerk_user_data.get("primary_email_address_id"))
     email = primary_email_obj.get("email_address") if primary_email_obj else None
-    if not email and clerk_user_data.get("email_addresses"):
-        email = clerk_user_data["email_addresses"][0].get("email_address")
+    if not email and email_addresses:
+        email = email_addresses[0].get("email_address")
 
     if not email:
         raise HTTPException(
@@ -148,11 +349,82 @@ def _extract_user_identity(clerk_user_data: Dict[str, Any]) -> tuple[str, Option
     return email, _extract_name(clerk_user_data)
 
 
+def _get_user(db: Session, clerk_user_id: str) -> Optional[User]:
+    return db.execute(
+        _USER_BY_CLERK_ID, {"clerk_user_id": clerk_user_id}
+    ).scalar_one_or_none()
+
+
+def _remember_user_id(clerk_user_id: str) -> None:
+    _seen_user_ids[clerk_user_id] = None
+    _seen_user_ids.move_to_end(clerk_user_id)
+    if len(_seen_user_ids) > SEEN_USER_IDS_MAX_SIZE:
+        _seen_user_ids.popitem(last=False)
+
+
+def _should_speculate(clerk_user_id: str) -> bool:
+    if clerk_user_id in _seen_user_ids:
+        _seen_user_ids.move_to_end(clerk_user_id)
+        return False
+    return _take_speculative_fetch_budget()
+
+
+def _take_speculative_fetch_budget() -> bool:
+    global _speculative_window_start, _speculative_fetches_in_window
+    now = time.monotonic()
+    if now - _speculative_window_start >= 60:
+        _speculative_window_start, _speculative_fetches_in_window = now, 0
+    if _speculative_fetches_in_window >= SPECULATIVE_CLERK_FETCHES_PER_MINUTE:
+        return False
+    _speculative_fetches_in_window += 1
+    return True
+
+
+def _log_discarded_lookup(task: asyncio.Task) -> None:
+    # Retrieve the outcome so a lookup that already failed is not reported as
+    # unhandled, but keep failures such as Clerk 429s visible.
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.warning(
+            "Discarded speculative Clerk lookup failed: %s",
+            getattr(exc, "detail", exc),
+        )
+
+
+def _cancel_task(task: Optional[asyncio.Task]) -> None:
+    if task is None:
+        return
+    task.cancel()
+    task.add_done_callback(_log_discarded_lookup)
+
+
+def _create_user(
+    db: Session, clerk_user_id: str, email: str, name: Optional[str]
+) -> User:
+    # Inserts the user or returns the row a concurrent request already created.
+    insert = _UPSERT_INSERTS[db.get_bind().dialect.name]
+    stmt = (
+        insert(User)
+        .values(clerk_user_id=clerk_user_id, email=email, name=name)
+        .on_conflict_do_update(
+            index_elements=[User.clerk_user_id],
+            set_={"clerk_user_id": clerk_user_id},
+        )
+        .returning(User)
+    )
+    user = db.execute(stmt).scalar_one()
+    db.commit()
+    db.refresh(user)
+    return user
+
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db),
 ) -> User:
-    payload = validate_jwt(credentials.credentials)
+    payload = await validate_jwt(credentials.credentials)
 
     user_id = payload.get("sub")
     if not user_id:
@@ -162,12 +434,26 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user = db.query(User).filter_by(clerk_user_id=user_id).first()
+    email, name = _extract_claim_identity(payload)
+
+    # New users may need a Clerk lookup to be provisioned, so start it
+    # alongside the database probe instead of after it.
+    clerk_lookup: Optional[asyncio.Task] = None
+    if not email and settings.CLERK_SECRET_KEY and _should_speculate(user_id):
+        clerk_lookup = asyncio.create_task(_fetch_clerk_user(user_id))
+
+    # The session is synchronous, so keep its I/O off the event loop.
+    try:
+        user = await run_in_threadpool(_get_user, db, user_id)
+    except BaseException:
+        _cancel_task(clerk_lookup)
+        raise
     if user:
+        _cancel_task(clerk_lookup)
+        _remember_user_id(user_id)
         return user
 
     try:
-        email, name = _extract_claim_identity(payload)
         if not email:
             if not settings.CLERK_SECRET_KEY:
                 raise HTTPException(
@@ -177,34 +463,31 @@ async def get_current_user(
                         "include an email claim in the Clerk JWT template."
                     ),
                 )
-            clerk_user_data = await _fetch_clerk_user(user_id, settings.CLERK_SECRET_KEY)
+            if clerk_lookup is None:
+                clerk_lookup = asyncio.create_task(_fetch_clerk_user(user_id))
+            clerk_user_data = await clerk_lookup
             email, name = _extract_user_identity(clerk_user_data)
 
-        user = User(clerk_user_id=user_id, email=email, name=name)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+        user = await run_in_threadpool(_create_user, db, user_id, email, name)
+        _remember_user_id(user_id)
         logger.info("Provisioned user for clerk_user_id=%s", user_id)
         return user
     except HTTPException:
         raise
     except IntegrityError:
-        db.rollback()
-        user = db.query(User).filter_by(clerk_user_id=user_id).first()
-        if user:
-            return user
+        await run_in_threadpool(db.rollback)
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="User record conflict while provisioning",
         )
     except httpx.HTTPError:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail="Unable to reach authentication provider",
         )
     except Exception:
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         logger.exception("Unexpected error while provisioning user")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -216,15 +499,19 @@ async def optional_current_user(
     authorization: Optional[str] = Header(None),
     db: Session = Depends(get_db),
 ) -> Optional[User]:
-    if not authorization or not authorization.lower().startswith("bearer "):
+    if (
+        not authorization
+        or len(authorization) < 8
+        or authorization[:7].lower() != "bearer "
+    ):
         return None
 
-    token = authorization.split(" ", 1)[1]
+    token = authorization[7:].strip()
     try:
-        payload = validate_jwt(token)
+        payload = await validate_jwt(token)
         user_id = payload.get("sub")
         if not user_id:
             return None
-        return db.query(User).filter_by(clerk_user_id=user_id).first()
+        return await run_in_threadpool(_get_user, db, user_id)
     except HTTPException:
         return None
@@ -1,4 +1,4 @@
-from functools import lru_cache
+from functools import cached_property
 from typing import Optional
 
 # Load .env file before initializing settings
@@ -29,6 +29,11 @@ class Settings(BaseSettings):
     DB_PORT: Optional[str] = None
     DB_NAME: Optional[str] = None
 
+    # Database - Connection pool, per worker process. Keep
+    # workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below Postgres max_connections.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+
     # Clerk Authentication
     CLERK_JWT_ISSUER: Optional[str] = Field(
         default=None,
@@ -53,16 +58,22 @@ class Settings(BaseSettings):
         "extra": "ignore",
     }
 
-    def get_database_url(self) -> str:
+    @cached_property
+    def database_url(self) -> str:
         """
-        Construct database URL from individual components if provided,
-        otherwise return the DATABASE_URL
+        Database URL built from individual components if provided,
+        otherwise the DATABASE_URL
         """
+        user, password, host, port, name = (
+            self.DB_USER,
+            self.DB_PASSWORD,
+            self.DB_HOST,
+            self.DB_PORT,
+            self.DB_NAME,
+        )
         # If all individual DB components are present, construct the URL
-        if all(
-            [self.DB_USER, self.DB_PASSWORD, self.DB_HOST, self.DB_PORT, self.DB_NAME]
-        ):
-            return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        if user and password and host and port and name:
+            return f"postgresql://{user}:{password}@{host}:{port}/{name}"
 
         if self.DATABASE_URL:
             return self.DATABASE_URL
@@ -71,9 +82,10 @@ class Settings(BaseSettings):
             "Database configuration missing. Set DATABASE_URL or all DB_* variables."
         )
 
-    def get_cors_origins(self) -> list[str]:
+    @cached_property
+    def cors_origins(self) -> list[str]:
         """
-        Return configured CORS origins. Falls back to local dev origins.
+        Configured CORS origins, parsed once. Falls back to local dev origins.
         """
         if self.CORS_ALLOW_ORIGINS.strip():
             return [
@@ -115,13 +127,5 @@ class Settings(BaseSettings):
         return f"{frontend_url.rstrip('/')}/?checkout=canceled"
 
 
-@lru_cache
-def get_settings() -> Settings:
-    """
-    Get application settings as a cached singleton to avoid reloading for every request
-    """
-    return Settings()
-
-
 # Create and export a singleton instance
-settings = get_settings()
+settings = Settings()
@@ -36,9 +36,13 @@ class DatabaseSessionManager:
             if is_postgres:
                 db_engine = create_engine(
                     database_url,
-                    pool_size=5,
-                    max_overflow=10,
+                    pool_size=settings.DB_POOL_SIZE,
+                    max_overflow=settings.DB_MAX_OVERFLOW,
+                    # Pre-ping catches connections dropped by restarts, failover or
+                    # proxy idle timeouts; recycling only retires old connections.
                     pool_pre_ping=True,
+                    pool_recycle=1800,
+                    pool_timeout=5,
                     poolclass=QueuePool,
                 )
             else:
@@ -77,7 +81,7 @@ class DatabaseSessionManager:
         return session_factory
 
 
-database_manager = DatabaseSessionManager(settings.get_database_url)
+database_manager = DatabaseSessionManager(lambda: settings.database_url)
 
 
 def initialize_database():
@@ -1,10 +1,19 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import logging
 
 from app.api.api import api_router
+from app.core.auth import (
+    close_clerk_client,
+    get_clerk_client,
+    refresh_jwks,
+    refresh_jwks_periodically,
+)
 from app.core.config import settings
 from app.db.session import initialize_database
 
@@ -18,17 +27,28 @@ logging.basicConfig(
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    initialize_database()
+    await run_in_threadpool(initialize_database)
+    get_clerk_client()
+    await refresh_jwks()
+    jwks_refresher = asyncio.create_task(refresh_jwks_periodically())
     yield
+    jwks_refresher.cancel()
+    with suppress(asyncio.CancelledError):
+        await jwks_refresher
+    await close_clerk_client()
 
 
-app = FastAPI(title="Fullstack Template API", lifespan=lifespan)
+app = FastAPI(
+    title="Fullstack Template API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.get_cors_origins(),
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -67,4 +87,10 @@ async def get_info():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        http="httptools",
+    )
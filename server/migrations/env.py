@@ -16,7 +16,7 @@ target_metadata = Base.metadata
 
 
 def get_url() -> str:
-    return settings.get_database_url()
+    return settings.database_url
 
 
 def run_migrations_offline() -> None:
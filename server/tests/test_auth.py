@@ -1,41 +1,67 @@
 import asyncio
 import os
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from fastapi import HTTPException
 from fastapi.security import HTTPAuthorizationCredentials
+from cryptography.hazmat.primitives.asymmetric import rsa
+import jwt
+from jwt import PyJWKClientConnectionError, PyJWKSet
+from jwt.algorithms import RSAAlgorithm
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 
 os.environ.setdefault("DATABASE_URL", "sqlite:///./test_auth.db")
 os.environ.setdefault("CLERK_JWT_ISSUER", "https://issuer.example.clerk.accounts.dev")
 
 import app.core.auth as auth
+from app.db.base_class import Base
 
 
-class QueryStub:
-    def filter_by(self, **_kwargs):
-        return self
+def make_session() -> Session:
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    return Session(bind=engine)
 
-    def first(self):
-        return None
+
+class ResultStub:
+    def __init__(self, result=None):
+        self.result = result
+
+    def scalar_one_or_none(self):
+        return self.result
 
 
 class DBStub:
-    def __init__(self):
-        self.added_user = None
-        self.did_commit = False
+    def __init__(self, existing_user=None):
+        self.existing_user = existing_user
+
+    def execute(self, _statement, _params=None):
+        return ResultStub(self.existing_user)
+
+
+SIGNING_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
 
-    def query(self, _model):
-        return QueryStub()
 
-    def add(self, user):
-        self.added_user = user
+def make_jwks(kid="key_1") -> PyJWKSet:
+    jwk = RSAAlgorithm.to_jwk(SIGNING_KEY.public_key(), as_dict=True)
+    return PyJWKSet.from_dict({"keys": [{**jwk, "kid": kid, "use": "sig"}]})
 
-    def commit(self):
-        self.did_commit = True
 
-    def refresh(self, _user):
-        pass
+def make_token(kid="key_1") -> str:
+    return jwt.encode(
+        {"sub": "user_123", "iss": auth._JWT_ISSUER, "exp": time.time() + 600},
+        SIGNING_KEY,
+        algorithm="RS256",
+        headers={"kid": kid},
+    )
 
 
 class FakeResponse:
@@ -46,23 +72,51 @@ class FakeResponse:
 
 
 class FakeAsyncClient:
-    async def __aenter__(self):
-        return self
+    async def get(self, *_args, **_kwargs):
+        return FakeResponse()
+
+
+class RateLimitedResponse:
+    status_code = 429
+
 
-    async def __aexit__(self, _exc_type, _exc, _tb):
-        return False
+class CountingAsyncClient:
+    def __init__(self, response):
+        self.response = response
+        self.calls = 0
 
     async def get(self, *_args, **_kwargs):
-        return FakeResponse()
+        self.calls += 1
+        return self.response
+
+
+class HangingAsyncClient:
+    def __init__(self):
+        self.cancelled = False
+
+    async def get(self, *_args, **_kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
 
 
 class AuthTests(unittest.TestCase):
+    def setUp(self):
+        auth._token_cache.clear()
+        auth._jwks = None
+        auth._jwks_fetched_at = float("-inf")
+        auth._jwks_failed_at = float("-inf")
+        auth._speculative_window_start = float("-inf")
+        auth._seen_user_ids.clear()
+
     def test_get_current_user_preserves_http_exception_status(self):
         creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="token")
 
         with patch.object(auth, "validate_jwt", return_value={"sub": "user_123"}):
             with patch.object(auth.settings, "CLERK_SECRET_KEY", "sk_test"):
-                with patch("app.core.auth.httpx.AsyncClient", return_value=FakeAsyncClient()):
+                with patch.object(auth, "get_clerk_client", return_value=FakeAsyncClient()):
                     with self.assertRaises(HTTPException) as ctx:
                         asyncio.run(auth.get_current_user(credentials=creds, db=DBStub()))
 
@@ -70,7 +124,7 @@ class AuthTests(unittest.TestCase):
 
     def test_get_current_user_provisions_from_jwt_claims_without_clerk_secret(self):
         creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="token")
-        db = DBStub()
+        db = make_session()
 
         with patch.object(
             auth,
@@ -88,7 +142,213 @@ class AuthTests(unittest.TestCase):
         self.assertEqual(user.clerk_user_id, "user_123")
         self.assertEqual(user.email, "user@example.com")
         self.assertEqual(user.name, "Launch User")
-        self.assertTrue(db.did_commit)
+        self.assertEqual(db.query(auth.User).count(), 1)
+
+    def test_get_user_looks_up_by_clerk_user_id(self):
+        db = make_session()
+        auth._create_user(db, "user_123", "one@example.com", None)
+        auth._create_user(db, "user_456", "two@example.com", None)
+
+        user = auth._get_user(db, "user_456")
+
+        self.assertEqual(user.email, "two@example.com")
+        self.assertIsNone(auth._get_user(db, "user_789"))
+
+    def test_create_user_returns_row_provisioned_concurrently(self):
+        db = make_session()
+        existing = auth._create_user(db, "user_123", "user@example.com", "Launch User")
+
+        user = auth._create_user(db, "user_123", "user@example.com", None)
+
+        self.assertEqual(user.id, existing.id)
+        self.assertEqual(user.name, "Launch User")
+        self.assertEqual(db.query(auth.User).count(), 1)
+
+    def test_get_current_user_cancels_clerk_lookup_for_existing_user(self):
+        creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="token")
+        existing_user = auth.User(id=7, clerk_user_id="user_123", email="user@example.com")
+        clerk_client = HangingAsyncClient()
+
+        with patch.object(auth, "validate_jwt", return_value={"sub": "user_123"}):
+            with patch.object(auth.settings, "CLERK_SECRET_KEY", "sk_test"):
+                with patch.object(auth, "get_clerk_client", return_value=clerk_client):
+                    user = asyncio.run(
+                        auth.get_current_user(
+                            credentials=creds, db=DBStub(existing_user=existing_user)
+                        )
+                    )
+
+        self.assertIs(user, existing_user)
+        self.assertTrue(clerk_client.cancelled)
+
+    def test_get_current_user_limits_speculative_clerk_lookups(self):
+        creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="token")
+        existing_user = auth.User(id=7, clerk_user_id="user_123", email="user@example.com")
+        clerk_client = CountingAsyncClient(RateLimitedResponse())
+
+        request_count = auth.SPECULATIVE_CLERK_FETCHES_PER_MINUTE + 5
+        payloads = [{"sub": f"user_{index}"} for index in range(request_count)]
+
+        async def run_requests():
+            for _ in range(request_count):
+                await auth.get_current_user(
+                    credentials=creds, db=DBStub(existing_user=existing_user)
+                )
+                await asyncio.sleep(0)
+
+        with patch.object(auth, "validate_jwt", side_effect=payloads):
+            with patch.object(auth.settings, "CLERK_SECRET_KEY", "sk_test"):
+                with patch.object(auth, "get_clerk_client", return_value=clerk_client):
+                    with self.assertLogs(auth.logger, level="WARNING") as logs:
+                        asyncio.run(run_requests())
+
+        self.assertLessEqual(clerk_client.calls, auth.SPECULATIVE_CLERK_FETCHES_PER_MINUTE)
+        self.assertIn("status=429", logs.output[0])
+
+    def test_get_current_user_skips_speculative_lookup_for_seen_user(self):
+        creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="token")
+        existing_user = auth.User(id=7, clerk_user_id="user_123", email="user@example.com")
+        clerk_client = CountingAsyncClient(RateLimitedResponse())
+
+        async def run_requests():
+            for _ in range(3):
+                await auth.get_current_user(
+                    credentials=creds, db=DBStub(existing_user=existing_user)
+                )
+                await asyncio.sleep(0)
+
+        with patch.object(auth, "validate_jwt", return_value={"sub": "user_123"}):
+            with patch.object(auth.settings, "CLERK_SECRET_KEY", "sk_test"):
+                with patch.object(auth, "get_clerk_client", return_value=clerk_client):
+                    with self.assertLogs(auth.logger, level="WARNING"):
+                        asyncio.run(run_requests())
+
+        self.assertEqual(clerk_client.calls, 1)
+
+    def test_optional_current_user_ignores_non_bearer_header(self):
+        user = asyncio.run(
+            auth.optional_current_user(authorization="Basic dXNlcjpwYXNz", db=DBStub())
+        )
+
+        self.assertIsNone(user)
+
+    def test_optional_current_user_accepts_case_insensitive_bearer_prefix(self):
+        existing_user = auth.User(id=7, clerk_user_id="user_123", email="user@example.com")
+
+        with patch.object(auth, "validate_jwt", return_value={"sub": "user_123"}) as validate:
+            user = asyncio.run(
+                auth.optional_current_user(
+                    authorization="bearer token", db=DBStub(existing_user=existing_user)
+                )
+            )
+
+        validate.assert_called_once_with("token")
+        self.assertIs(user, existing_user)
+
+    def test_validate_jwt_reuses_cached_payload_until_near_expiry(self):
+        auth._token_cache.clear()
+        payload = {"sub": "user_123", "exp": time.time() + 600}
+
+        with patch.object(auth, "_decode_jwt", return_value=payload) as decode:
+            self.assertIs(asyncio.run(auth.validate_jwt("token")), payload)
+            self.assertIs(asyncio.run(auth.validate_jwt("token")), payload)
+
+        self.assertEqual(decode.call_count, 1)
+
+    def test_validate_jwt_evicts_least_recently_used_payload(self):
+        payloads = {
+            token: {"sub": token, "exp": time.time() + 600}
+            for token in ("hot", "cold", "new")
+        }
+
+        with patch.object(auth, "TOKEN_CACHE_MAX_SIZE", 2):
+            with patch.object(auth, "_decode_jwt", side_effect=payloads.get) as decode:
+                for token in ("hot", "cold", "hot", "new", "hot"):
+                    asyncio.run(auth.validate_jwt(token))
+
+        self.assertEqual(decode.call_count, 3)
+
+    def test_validate_jwt_does_not_serve_payload_about_to_expire(self):
+        auth._token_cache.clear()
+        payload = {"sub": "user_123", "exp": time.time() + 5}
+
+        with patch.object(auth, "_decode_jwt", return_value=payload) as decode:
+            asyncio.run(auth.validate_jwt("token"))
+            asyncio.run(auth.validate_jwt("token"))
+
+        self.assertEqual(decode.call_count, 2)
+
+    def test_validate_jwt_returns_unavailable_when_jwks_unreachable(self):
+        jwks_client = Mock()
+        jwks_client.get_jwk_set.side_effect = PyJWKClientConnectionError("down")
+
+        with patch.object(auth, "_get_jwks_client", return_value=jwks_client):
+            with self.assertLogs(auth.logger, level="WARNING"):
+                with self.assertRaises(HTTPException) as ctx:
+                    asyncio.run(auth.validate_jwt(make_token()))
+
+        self.assertEqual(ctx.exception.status_code, 503)
+
+    def test_validate_jwt_keeps_last_jwks_when_refresh_fails(self):
+        auth._jwks = make_jwks()
+        auth._jwks_fetched_at = time.monotonic() - 2 * auth.JWKS_CACHE_LIFESPAN_SECONDS
+        jwks_client = Mock()
+        jwks_client.get_jwk_set.side_effect = ValueError("not JSON")
+
+        with patch.object(auth, "_get_jwks_client", return_value=jwks_client):
+            with self.assertLogs(auth.logger, level="WARNING"):
+                asyncio.run(auth.refresh_jwks())
+            payload = asyncio.run(auth.validate_jwt(make_token()))
+
+        self.assertEqual(payload["sub"], "user_123")
+        jwks_client.get_jwk_set.assert_called_once()
+
+    def test_validate_jwt_returns_unavailable_when_jwks_too_stale(self):
+        auth._jwks = make_jwks()
+        auth._jwks_fetched_at = time.monotonic() - auth.JWKS_MAX_STALENESS_SECONDS - 1
+
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(auth.validate_jwt(make_token()))
+
+        self.assertEqual(ctx.exception.status_code, 503)
+
+    def test_validate_jwt_skips_refetch_when_jwks_is_fresh(self):
+        auth._jwks = make_jwks()
+        auth._jwks_fetched_at = time.monotonic()
+        jwks_client = Mock()
+
+        with patch.object(auth, "_get_jwks_client", return_value=jwks_client):
+            with self.assertRaises(HTTPException) as ctx:
+                asyncio.run(auth.validate_jwt(make_token(kid="unknown")))
+
+        self.assertEqual(ctx.exception.status_code, 401)
+        jwks_client.get_jwk_set.assert_not_called()
+
+    def test_validate_jwt_refetches_jwks_for_rotated_key(self):
+        auth._jwks = make_jwks(kid="old_key")
+        auth._jwks_fetched_at = time.monotonic() - 2 * auth.JWKS_MIN_FETCH_INTERVAL_SECONDS
+        jwks_client = Mock()
+        jwks_client.get_jwk_set.return_value = make_jwks(kid="new_key")
+
+        with patch.object(auth, "_get_jwks_client", return_value=jwks_client):
+            payload = asyncio.run(auth.validate_jwt(make_token(kid="new_key")))
+            with self.assertRaises(HTTPException):
+                asyncio.run(auth.validate_jwt(make_token(kid="garbage")))
+
+        self.assertEqual(payload["sub"], "user_123")
+        jwks_client.get_jwk_set.assert_called_once()
+
+    def test_get_clerk_client_reuses_shared_client(self):
+        with patch.object(auth.settings, "CLERK_SECRET_KEY", "sk_test"):
+            client = auth.get_clerk_client()
+        try:
+            self.assertIs(auth.get_clerk_client(), client)
+            self.assertEqual(client.headers["Authorization"], "Bearer sk_test")
+        finally:
+            asyncio.run(auth.close_clerk_client())
+
+        self.assertTrue(client.is_closed)
+        self.assertIsNone(auth._clerk_client)
 
     def test_extract_user_identity_allows_missing_name(self):
         email, name = auth._extract_user_identity(
@@ -106,6 +366,22 @@ class AuthTests(unittest.TestCase):
         self.assertEqual(email, "user@example.com")
         self.assertIsNone(name)
 
+    def test_extract_user_identity_falls_back_to_first_email(self):
+        email, name = auth._extract_user_identity(
+            {
+                "primary_email_address_id": "email_missing",
+                "email_addresses": [
+                    {"id": "email_123", "email_address": "first@example.com"},
+                    {"id": "email_456", "email_address": "second@example.com"},
+                ],
+                "first_name": "Launch",
+                "last_name": None,
+            }
+        )
+
+        self.assertEqual(email, "first@example.com")
+        self.assertEqual(name, "Launch")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -33,7 +33,32 @@ class FailingDB:
         pass
 
 
+class RecordingDB:
+    def __init__(self):
+        self.did_commit = False
+
+    def commit(self):
+        self.did_commit = True
+
+    def refresh(self, _obj):
+        pass
+
+
 class UserRouteTests(unittest.TestCase):
+    def test_update_user_only_applies_fields_that_were_set(self):
+        db = RecordingDB()
+        user = DummyUser()
+
+        updated = asyncio.run(
+            update_user(user_data=UserUpdate(name=None), current_user=user, db=db)
+        )
+        untouched = DummyUser()
+        asyncio.run(update_user(user_data=UserUpdate(), current_user=untouched, db=db))
+
+        self.assertIsNone(updated.name)
+        self.assertEqual(untouched.name, "Initial")
+        self.assertTrue(db.did_commit)
+
     def test_update_user_returns_conflict_on_integrity_error(self):
         db = FailingDB()
         user = DummyUser()